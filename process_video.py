@@ -244,7 +244,104 @@ class ImageThresholder:
         combined_hls[(hls_binary == 1) | (combined == 1)] = 1
         
         return combined_hls, combined, hls_binary
-    
+
+class NonzeroPixelIndex:
+    """
+    This class holds a row-sorted sparse index of the white points of a binary image
+
+    The index is built once per frame, queries use binary searches so their cost
+    depends on the number of white points instead of the image area
+
+    Attributes:
+    height: integer
+        Height of the indexed image
+    width: integer
+        Width of the indexed image
+    cols: numpy array
+        int16 x coordinates of the points, sorted inside every row, so the width is limited to 32767
+    keys: numpy array
+        Sorted int32 y * width + x keys of the points, used for the binary searches
+    """
+
+    def __init__(self, image):
+        """
+        Builds the index from a binary image
+
+        Parameters
+        ----------
+        image : numpy array
+            The binary image to index
+        """
+        self.height, self.width = image.shape[0], image.shape[1]
+        assert self.width <= np.iinfo(np.int16).max, "image is too wide for int16 columns"
+        assert self.height * self.width <= np.iinfo(np.int32).max, "image is too large for int32 keys"
+
+        #np.nonzero returns the points in row-major order, so they are already sorted
+        rows, cols = np.nonzero(image == 1)
+        self.cols = cols.astype(np.int16)
+        self.keys = rows.astype(np.int32) * self.width + self.cols
+
+    def window_points(self, start_y, end_y, start_x, end_x):
+        """
+        Finds the white points inside the [start_y:end_y, start_x:end_x] window
+
+        Parameters
+        ----------
+        start_y: integer
+            y coordinate - top of the window
+        end_y: integer
+            y coordinate - bottom of the window, exclusive
+        start_x: integer
+            x coordinate - left side of the window
+        end_x: integer
+            x coordinate - right side of the window, exclusive
+        Returns
+        -------
+        points_x : numpy array
+            x coordinates of the points inside the window
+        points_y : numpy array
+            y coordinates of the points inside the window
+        """
+        rows = np.arange(max(int(start_y), 0), min(int(end_y), self.height), dtype=np.int32)
+        start_x = min(max(int(start_x), 0), self.width)
+        end_x = min(max(int(end_x), start_x), self.width)
+
+        #Binary search for the first and last point of every row inside the window
+        begin = np.searchsorted(self.keys, rows * self.width + start_x)
+        end = np.searchsorted(self.keys, rows * self.width + end_x)
+
+        #Expands the [begin, end) ranges of every row to point positions
+        counts = end - begin
+        total = np.sum(counts)
+        range_starts = np.cumsum(counts) - counts
+        positions = np.repeat(begin - range_starts, counts) + np.arange(total)
+
+        return self.cols[positions].astype(np.int32), np.repeat(rows, counts)
+
+    def column_histogram(self, start_y, end_y, start_x, end_x):
+        """
+        Counts the white points per column inside the [start_y:end_y, start_x:end_x] window
+
+        Parameters
+        ----------
+        start_y: integer
+            y coordinate - top of the window
+        end_y: integer
+            y coordinate - bottom of the window, exclusive
+        start_x: integer
+            x coordinate - left side of the window, may be outside of the image
+        end_x: integer
+            x coordinate - right side of the window, exclusive, may be outside of the image
+        Returns
+        -------
+        histogram : numpy array
+            Number of points for every column from start_x to end_x, columns outside of the image are 0
+        """
+        start_x = int(start_x)
+        end_x = int(end_x)
+        points_x, _ = self.window_points(start_y, end_y, start_x, end_x)
+        return np.bincount(points_x - start_x, minlength=max(end_x - start_x, 0))
+
 class LineDetector:
     """
     This class finds lines in a binary image using sliding window algorithm
@@ -258,14 +355,18 @@ class LineDetector:
     x_size = 30
     y_step = 100
     
-    def sliding_window_step(self, image, start_x, end_y, x_search_region = 100):
+    def sliding_window_step(self, index, start_x, end_y, x_search_region = 100):
         """
         Calculates one step of the sliding window algorithm
 
+        Windows reaching past the image border are clipped to the part inside the image.
+        Earlier versions sliced the dense image, so windows with a negative left side
+        came out empty or wrapped around to the right-hand columns.
+
         Parameters
         ----------
-        image : numpy array
-            The image to process
+        index : NonzeroPixelIndex
+            The white points of the image to process
         start_x: integer
             x coordinate - where to start searching in horizontal direction
         end_y: integer
@@ -279,14 +380,15 @@ class LineDetector:
         start_y: integer
             Starting y coordinate for the next iteration
         """
-        arr = np.empty((2 * x_search_region))
-        
-        #Finds the regions with most points
+        #Counts the points per column over all the candidate windows at once
         start_y = np.max((end_y - self.y_step, 0))
-        for i in range(- x_search_region, x_search_region):
-            x_start = int(start_x + i - self.x_size)
-            x_end = int(start_x + i + self.x_size)
-            arr[x_search_region + i] = np.sum(image[start_y:end_y, x_start:x_end])
+        x_start = int(start_x) - x_search_region - self.x_size
+        x_end = int(start_x) + x_search_region + self.x_size
+        histogram = index.column_histogram(start_y, end_y, x_start, x_end)
+        
+        #Finds the regions with most points, window i covers [x_start + i:x_start + i + 2 * self.x_size]
+        cumulative = np.concatenate(([0], np.cumsum(histogram)))
+        arr = cumulative[2 * self.x_size:2 * (self.x_size + x_search_region)] - cumulative[:2 * x_search_region]
         
         #Filters noise, keeps the sliding window the same as previous iteration
         if np.argmax(arr) < 20:
@@ -296,14 +398,14 @@ class LineDetector:
         
         return next_step_x, start_y
         
-    def sliding_window_one_side(self, image, start_x, output, func=None):
+    def sliding_window_one_side(self, index, start_x, output, func=None):
         """
         Applies the sliding window algorithm for one line, starting from start_x
 
         Parameters
         ----------
-        image : numpy array
-            The image to process
+        index : NonzeroPixelIndex
+            The white points of the image to process
         start_x: integer
             x coordinate - where to start searching in horizontal direction
         output: numpy array
@@ -319,7 +421,7 @@ class LineDetector:
         indicies_y = []
         
         current_step_x = start_x
-        current_step_y = image.shape[0]
+        current_step_y = index.height
         
         #Debugging - draws the current window
         cv2.rectangle(output, (int(start_x - self.x_size), current_step_y), 
@@ -330,17 +432,15 @@ class LineDetector:
             #Do we have data from previous frames
             if func != None:
                 current_step_x = func(current_step_y)
-                next_step_x, next_step_y = self.sliding_window_step(image, current_step_x, current_step_y, 50)
+                next_step_x, next_step_y = self.sliding_window_step(index, current_step_x, current_step_y, 50)
             else:
-                next_step_x, next_step_y = self.sliding_window_step(image, current_step_x, current_step_y)
-            
-            #Gets the part of the image for the current window
-            arr = image[next_step_y: current_step_y, next_step_x - self.x_size: next_step_x + self.x_size]
+                next_step_x, next_step_y = self.sliding_window_step(index, current_step_x, current_step_y)
             
-            #Gets the indicies for all the white points and adds them to the result arrays
-            current_indicies = np.where( arr == 1)
-            indicies_y.append(current_indicies[0] +  next_step_y)
-            indicies_x.append(current_indicies[1] +  (next_step_x - self.x_size))
+            #Gets the indicies for all the white points in the current window and adds them to the result arrays
+            current_x, current_y = index.window_points(next_step_y, current_step_y,
+                                                       next_step_x - self.x_size, next_step_x + self.x_size)
+            indicies_y.append(current_y)
+            indicies_x.append(current_x)
             
             #Debugging - draws the current window
             cv2.rectangle(output, (int(next_step_x - self.x_size), current_step_y), 
@@ -375,19 +475,21 @@ class LineDetector:
         """
         output = np.copy(image)
         
+        #Builds the sparse index of the white points once per frame
+        index = NonzeroPixelIndex(image)
         
         if l_points_prev == None or r_points_prev == None:            
-            start_left, start_right = self.get_starting_points_histogram(image)
-            left_indicies = self.sliding_window_one_side(image, start_left, output)
-            right_indicies = self.sliding_window_one_side(image, start_right, output)
+            start_left, start_right = self.get_starting_points_histogram(index)
+            left_indicies = self.sliding_window_one_side(index, start_left, output)
+            right_indicies = self.sliding_window_one_side(index, start_right, output)
         else:
             left_func = self.get_starting_points_previous(l_points_prev)
             right_func = self.get_starting_points_previous(r_points_prev)
             start_left = left_func(720)
             start_right = right_func(720)
             
-            left_indicies = self.sliding_window_one_side(image, start_left, output, left_func)
-            right_indicies = self.sliding_window_one_side(image, start_right, output, right_func)
+            left_indicies = self.sliding_window_one_side(index, start_left, output, left_func)
+            right_indicies = self.sliding_window_one_side(index, start_right, output, right_func)
 
         
         return left_indicies, right_indicies, output
@@ -408,14 +510,14 @@ class LineDetector:
         polyfit = np.polyfit(points[1], points[0], 2)
         return lambda y: polyfit[0]*y**2 + polyfit[1]*y + polyfit[2]
         
-    def get_starting_points_histogram(self, image, x_region=50):
+    def get_starting_points_histogram(self, index, x_region=50):
         """
         Calculates starting points by using a histogram
 
         Parameters
         ----------
-        image : numpy array
-            The image to process
+        index : NonzeroPixelIndex
+            The white points of the image to process
         Returns
         -------
         start_left : integer
@@ -424,14 +526,15 @@ class LineDetector:
             X coord - Where to start searching for right line marking
         """
             
-        histogram = np.sum(image[image.shape[0]/2:,:], axis=0)
-        sliding_peaks = np.empty((histogram.shape[0]))
-
-        for i in range(0, histogram.shape[0]):
-            sliding_peaks[i] = np.sum(histogram[i:(i + 2 * x_region)])
+        histogram = index.column_histogram(index.height // 2, index.height, 0, index.width)
+        
+        #sliding_peaks[i] is the sum of histogram[i:(i + 2 * x_region)]
+        cumulative = np.concatenate(([0], np.cumsum(histogram)))
+        window_ends = np.minimum(np.arange(index.width) + 2 * x_region, index.width)
+        sliding_peaks = cumulative[window_ends] - cumulative[:index.width]
         
-        start_left = np.argmax(sliding_peaks[0:sliding_peaks.shape[0]/2])
-        start_right = np.argmax(sliding_peaks[sliding_peaks.shape[0]/2:-1]) + sliding_peaks.shape[0]/2
+        start_left = np.argmax(sliding_peaks[0:sliding_peaks.shape[0]//2])
+        start_right = np.argmax(sliding_peaks[sliding_peaks.shape[0]//2:-1]) + sliding_peaks.shape[0]//2
         return start_left, start_right
         
 class VideoLineDrawer: